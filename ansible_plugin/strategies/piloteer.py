@@ -3,86 +3,243 @@ from ansible.utils.display import Display
 import socket
 import json
 import os
+import queue
+import threading
 import time
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 display = Display()
 
+# Static envelope fragments; only the per-event fields are encoded at send time
+TASK_RESULT_PREFIX = b'{"TaskResult":{"name":'
+TASK_RESULT_OK = b',"changed":false,"failed":false,"verbose_result":'
+TASK_RESULT_CHANGED = b',"changed":true,"failed":false,"verbose_result":'
+TASK_RESULT_FAILED = b',"changed":false,"failed":true,"verbose_result":'
+TASK_FAIL_PREFIX = b'{"TaskFail":{"name":'
+TASK_UNREACHABLE_PREFIX = b'{"TaskUnreachable":{"name":'
+HOST_FIELD = b',"host":'
+ERROR_FIELD = b',"error":'
+RESULT_FIELD = b',"result":'
+ENVELOPE_SUFFIX = b'}}'
+
 class SafeEncoder(json.JSONEncoder):
     def default(self, obj):
-        try:
-            return super(SafeEncoder, self).default(obj)
-        except TypeError:
-            return str(obj)
-
-    def login(self, obj):
+        # Only reached for objects the C encoder can't handle natively;
         # Ansible internal objects often fail serialization
         return str(obj)
 
 class StrategyModule(LinearStrategyModule):
     def __init__(self, tqm):
-        print("DEBUG: Piloteer Strategy Init", flush=True)
+        display.debug("[Piloteer] Strategy Init")
         super(StrategyModule, self).__init__(tqm)
         self.sock = None
+        self._rfile = None
+        # Outgoing frames are batched here and handed off by _flush()
+        self._wbuf = bytearray()
+        # Background writer, started once the handshake has succeeded
+        self._send_q = queue.SimpleQueue()
+        self._sender = None
+        # Reuse one encoder/decoder instead of rebuilding them per message.
+        # Both map to bytes; orjson is used when installed.
+        enc = SafeEncoder(separators=(',', ':'), ensure_ascii=False).encode
+        dec = json.JSONDecoder().decode
+        if orjson is not None:
+            # Hand dataclasses and datetimes to default=str like SafeEncoder does
+            option = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATACLASS |
+                      orjson.OPT_PASSTHROUGH_DATETIME)
+
+            def dumps(obj):
+                try:
+                    return orjson.dumps(obj, default=str, option=option)
+                except orjson.JSONEncodeError:
+                    # e.g. ints beyond 64 bits, which never reach default=;
+                    # the stdlib encoder handles those
+                    return enc(obj).encode('utf-8')
+
+            self._dumps = dumps
+            self._loads = orjson.loads
+        else:
+            self._dumps = lambda obj: enc(obj).encode('utf-8')
+            self._loads = lambda line: dec(line.decode('utf-8'))
         self._connect_to_piloteer()
 
     def _connect_to_piloteer(self):
         socket_path = os.environ.get("PILOTEER_SOCKET", "/tmp/piloteer.sock")
-        print(f"DEBUG: Connecting to Piloteer at {socket_path}", flush=True)
+        display.debug(f"[Piloteer] Connecting at {socket_path}")
         try:
             if ":" in socket_path:
                 # Assume TCP: host:port
                 host, port = socket_path.split(":", 1)
                 self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
                 self.sock.connect((host, int(port)))
             else:
                 # Assume Unix Socket
                 self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
                 self.sock.connect(socket_path)
-            
+
+            # Buffered reader: one recv serves many JSON lines
+            self._rfile = self.sock.makefile('rb', buffering=1 << 20)
+
             secret = os.environ.get("PILOTEER_SECRET")
             self._send({"Handshake": {"token": secret}})
             self._wait_for_proceed()
+
+            # Socket writes move off the strategy thread from here on
+            self._sender = threading.Thread(target=self._sender_loop,
+                                            args=(self._send_q, self.sock),
+                                            name="piloteer-sender", daemon=True)
+            self._sender.start()
         except Exception as e:
             display.warning(f"Could not connect to Piloteer at {socket_path}: {e}")
             self.sock = None
+            self._rfile = None
+
+    def _frame(self, data):
+        # Wire format is newline-delimited JSON, matching the Rust IpcConnection
+        try:
+            # _dumps stringifies objects it can't encode natively
+            payload = self._dumps(data)
+        except Exception as e:
+             payload = self._dumps({"Error": f"Serialization Failed: {str(e)}"})
+        return payload + b"\n"
+
+    def _encode_value(self, obj):
+        # Encode a single field so its bytes can be spliced into several envelopes
+        try:
+            return self._dumps(obj)
+        except Exception as e:
+            return self._dumps(f"<Serialization Failed: {str(e)}>")
+
+    def _read_message(self):
+        # Returns the next decoded message, or None once the socket is closed
+        while True:
+            line = self._rfile.readline()
+            if not line:
+                return None
+            try:
+                return self._loads(line)
+            except (UnicodeDecodeError, json.JSONDecodeError):
+                pass
 
     def _send(self, data):
         if self.sock:
-            try:
-                # Use SafeEncoder for robust serialization
-                msg = json.dumps(data, cls=SafeEncoder) + "\n"
-            except Exception as e:
-                 msg = json.dumps({"Error": f"Serialization Failed: {str(e)}"}) + "\n"
-            self.sock.sendall(msg.encode('utf-8'))
+            self._wbuf += self._frame(data)
+
+    def _send_raw(self, payload):
+        # payload is an already-encoded JSON object
+        if self.sock:
+            self._wbuf += payload + b"\n"
+
+    def _send_task_result(self, name, host_name, status, result_json):
+        # status is one of the TASK_RESULT_* fragments
+        self._send_raw(b"".join((TASK_RESULT_PREFIX, self._encode_value(name),
+                                 HOST_FIELD, self._encode_value(host_name),
+                                 status, result_json, ENVELOPE_SUFFIX)))
+
+    def _send_task_start(self, name, task_vars):
+        # task_vars is the largest message we send: write it into the buffer one
+        # variable at a time instead of materializing the whole JSON document
+        if not self.sock:
+            return
+        buf = self._wbuf
+        encode_value = self._encode_value
+        buf += b'{"TaskStart":{"name":' + encode_value(name) + b',"task_vars":{'
+        sep = b''
+        for k, v in task_vars.items():
+            # Filter internal vars; _dumps stringifies non-native values
+            if k.startswith("ansible_"):
+                continue
+            buf += sep
+            buf += encode_value(k)
+            buf += b':'
+            buf += encode_value(v)
+            sep = b','
+        buf += b'}}}\n'
+
+    def _flush(self):
+        if self.sock and self._wbuf:
+            if self._sender is not None:
+                self._send_q.put(self._wbuf)
+                self._wbuf = bytearray()
+            else:
+                self.sock.sendall(self._wbuf)
+                self._wbuf.clear()
+
+    def _disconnect(self):
+        # Send everything still pending, stop the sender and close the socket.
+        # Ansible creates a strategy per play and Piloteer serves one connection
+        # at a time, so the next play can only connect once it sees EOF.
+        if not self.sock:
+            return
+        self._flush()
+        if self._sender is not None:
+            self._send_q.put(None)
+            self._sender.join()
+            self._sender = None
+        self._rfile.close()
+        self.sock.close()
+        self._rfile = None
+        self.sock = None
+
+    @staticmethod
+    def _sender_loop(send_q, sock):
+        # Only this thread writes to the socket once started, so frame order
+        # is preserved without a barrier before reading replies. A None item
+        # from _disconnect() stops it after the preceding frames are written.
+        failed = False
+        running = True
+        while running:
+            chunks = []
+            item = send_q.get()
+            while True:
+                if item is None:
+                    running = False
+                    break
+                chunks.append(item)
+                try:
+                    item = send_q.get_nowait()
+                except queue.Empty:
+                    break
+            if chunks and not failed:
+                try:
+                    # A lone buffer (e.g. a large TaskStart) is written without a copy
+                    sock.sendall(chunks[0] if len(chunks) == 1 else b"".join(chunks))
+                except OSError as e:
+                    # Keep consuming so _disconnect() can still stop the thread
+                    failed = True
+                    display.warning(f"Lost connection to Piloteer: {e}")
 
     def _wait_for_proceed(self):
         if not self.sock:
             return
-        
-        buffer = ""
+
+        # Piloteer must see everything we sent before it can answer
+        self._flush()
+
         while True:
-            chunk = self.sock.recv(1024).decode('utf-8')
-            if not chunk:
-                break
-            buffer += chunk
-            if "\n" in buffer:
-                line, buffer = buffer.split("\n", 1)
-                try:
-                    msg = json.loads(line)
-                    if msg == "Proceed":
-                        return
-                except json.JSONDecodeError:
-                    pass
+            msg = self._read_message()
+            if msg is None or msg == "Proceed":
+                return
 
     def run(self, iterator, play_context):
         self.play_context = play_context
 
         # Send Play Start
         play_name = iterator._play.get_name()
-        # iterator._play.hosts could be a list or string, safer to str()
-        host_pattern = str(iterator._play.hosts)
-        
-        print(f"DEBUG: Sending PlayStart: {play_name}", flush=True)
+        # iterator._play.hosts could be a list or string; join lists into
+        # Ansible's comma pattern syntax rather than their Python repr
+        hosts = iterator._play.hosts
+        if isinstance(hosts, (list, tuple)):
+            host_pattern = ",".join(str(h) for h in hosts)
+        else:
+            host_pattern = str(hosts)
+
+        display.debug(f"[Piloteer] Sending PlayStart: {play_name}")
         self._send({
             "PlayStart": {
                 "name": play_name,
@@ -91,11 +248,11 @@ class StrategyModule(LinearStrategyModule):
         })
 
         result = super(StrategyModule, self).run(iterator, play_context)
-        print("DEBUG: Run finished, checking stats", flush=True)
+        display.debug("[Piloteer] Run finished, checking stats")
         
         # Send Play Recap
         if self._tqm and self._tqm._stats:
-            print("DEBUG: Sending PlayRecap", flush=True)
+            display.debug("[Piloteer] Sending PlayRecap")
             stats = {}
             stats['ok'] = self._tqm._stats.ok
             stats['failures'] = self._tqm._stats.failures
@@ -106,20 +263,30 @@ class StrategyModule(LinearStrategyModule):
             stats['ignored'] = self._tqm._stats.ignored
             
             self._send({"PlayRecap": {"stats": stats}})
-            
+
+        self._disconnect()
         return result
 
     def _process_pending_results(self, iterator, max_passes=1, one_pass=False):
-        # Capture previous states for rollback
+        # Capture previous states for rollback. Only hosts with a queued task
+        # (blocked) can report a result here, so skip the rest of the inventory.
         try:
-            prev_host_states = iterator.host_states.copy()
+            host_states = iterator.host_states
+            prev_host_states = {name: host_states[name]
+                                for name, blocked in self._blocked_hosts.items()
+                                if blocked and name in host_states}
         except AttributeError:
              prev_host_states = {}
 
         results = super(StrategyModule, self)._process_pending_results(iterator, max_passes, one_pass)
-        print(f"DEBUG: Pending Results Count: {len(results)}", flush=True)
+        display.debug(f"[Piloteer] Pending Results Count: {len(results)}")
         
-        cleaned_results = []
+        # Bind hot methods once; results are written into a pre-sized list
+        encode_value = self._encode_value
+        send_raw = self._send_raw
+        send_task_result = self._send_task_result
+        cleaned_results = [None] * len(results)
+        out = 0
         for res in results:
             if res.is_unreachable():
                 # Host Unreachable!
@@ -131,16 +298,14 @@ class StrategyModule(LinearStrategyModule):
                 error_msg = result_data.get('msg', 'Host unreachable')
                 
                 # Notify Piloteer
-                self._send({
-                    "TaskUnreachable": {
-                        "name": task,
-                        "host": host.name,
-                        "error": error_msg,
-                        "result": result_data
-                    }
-                })
+                send_raw(b"".join((TASK_UNREACHABLE_PREFIX, encode_value(task),
+                                   HOST_FIELD, encode_value(host.name),
+                                   ERROR_FIELD, encode_value(error_msg),
+                                   RESULT_FIELD, encode_value(result_data),
+                                   ENVELOPE_SUFFIX)))
                 # Don't enter debug loop for unreachable - just log and continue
-                cleaned_results.append(res)
+                cleaned_results[out] = res
+                out += 1
                 continue
                 
             if res.is_failed():
@@ -148,9 +313,12 @@ class StrategyModule(LinearStrategyModule):
                 host = res.host
                 task = res.task_name
                 result_data = res._return_data
+                # Encoded once: reused by TaskFail and by TaskResult on Continue
+                result_json = encode_value(result_data)
                 
                 # Notify Piloteer
-                self._send({"TaskFail": {"name": task, "result": result_data}})
+                send_raw(b"".join((TASK_FAIL_PREFIX, encode_value(task),
+                                   RESULT_FIELD, result_json, ENVELOPE_SUFFIX)))
                 
                 # Enter "Debug Mode" Loop
                 while True:
@@ -164,12 +332,13 @@ class StrategyModule(LinearStrategyModule):
                              iterator.set_state_for_host(host.name, prev_host_states[host.name])
                         
                         # 2. Un-fail host in TQM
-                        if host.name in self._tqm._failed_hosts:
-                            del self._tqm._failed_hosts[host.name]
+                        self._tqm._failed_hosts.pop(host.name, None)
                         
                         # 3. Put back in active hosts if it was removed
-                        if host.name in iterator._play._removed_hosts:
-                             iterator._play._removed_hosts.remove(host.name)
+                        try:
+                            iterator._play._removed_hosts.remove(host.name)
+                        except ValueError:
+                            pass
                              
                         # 4. Decrement Stats
                         self._tqm._stats.decrement('failures', host.name)
@@ -197,59 +366,46 @@ class StrategyModule(LinearStrategyModule):
                             display.display(f"[Piloteer] Modified {key} = {val} (Global/Extra Var)")
                             
                     elif cmd_type == "Continue":
-                        self._send({
-                            "TaskResult": {
-                                "name": task,
-                                "host": host.name,
-                                "changed": False,
-                                "failed": True,
-                                "verbose_result": result_data
-                            }
-                        })
-                        cleaned_results.append(res)
+                        send_task_result(task, host.name, TASK_RESULT_FAILED, result_json)
+                        cleaned_results[out] = res
+                        out += 1
                         break
                         
             else:
                 # Task Succeeded
-                is_changed = res.is_changed()
-                self._send({
-                    "TaskResult": {
-                        "name": res.task_name,
-                        "host": res.host.name,
-                        "changed": is_changed,
-                        "failed": False,
-                        "verbose_result": res._return_data
-                    }
-                })
-                cleaned_results.append(res)
-                
+                status = TASK_RESULT_CHANGED if res.is_changed() else TASK_RESULT_OK
+                send_task_result(res.task_name, res.host.name, status,
+                                 encode_value(res._return_data))
+                cleaned_results[out] = res
+                out += 1
+
+        del cleaned_results[out:]
+        self._flush()
         return cleaned_results
 
     def _wait_for_command(self):
         if not self.sock:
             return "Continue", None
-            
-        buffer = ""
+
+        self._flush()
         while True:
-            chunk = self.sock.recv(4096).decode('utf-8')
-            if not chunk:
+            msg = self._read_message()
+            if msg is None:
                 return "Continue", None
-            buffer += chunk
-            if "\n" in buffer:
-                line, buffer = buffer.split("\n", 1)
-                try:
-                    msg = json.loads(line)
-                    if msg == "Retry":
-                        return "Retry", None
-                    elif isinstance(msg, dict) and "ModifyVar" in msg:
-                        return "ModifyVar", msg["ModifyVar"]
-                    elif msg == "Continue":
-                        return "Continue", None
-                    elif msg == "Proceed":
-                         return "Continue", None
-                except json.JSONDecodeError:
-                    pass
+            if msg == "Retry":
+                return "Retry", None
+            elif isinstance(msg, dict) and "ModifyVar" in msg:
+                return "ModifyVar", msg["ModifyVar"]
+            elif msg == "Continue":
+                return "Continue", None
+            elif msg == "Proceed":
+                 return "Continue", None
     
+    def cleanup(self):
+        # Also reached when run() raised before disconnecting
+        self._disconnect()
+        super(StrategyModule, self).cleanup()
+
     def get_hosts_left(self, iterator):
         return super(StrategyModule, self).get_hosts_left(iterator)
 
@@ -259,9 +415,6 @@ class StrategyModule(LinearStrategyModule):
             first_host, first_task = hosts_tasks[0]
             if first_task:
                  task_vars = self._tqm._variable_manager.get_vars(host=first_host, task=first_task)
-                 # Filter internal vars but let SafeEncoder handle the rest
-                 serializable_vars = {k: v for k, v in task_vars.items() if not k.startswith("ansible_")}
-                 
-                 self._send({"TaskStart": {"name": first_task.get_name(), "task_vars": serializable_vars}})
+                 self._send_task_start(first_task.get_name(), task_vars)
                  self._wait_for_proceed()
         return hosts_tasks
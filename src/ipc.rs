@@ -146,12 +146,17 @@ impl AsyncWrite for ConnectionStream {
 }
 
 pub struct IpcConnection {
-    stream: ConnectionStream,
+    // Persistent reader so lines batched into one read are not dropped
+    stream: BufReader<ConnectionStream>,
+    line: Vec<u8>,
 }
 
 impl IpcConnection {
     pub fn new(stream: ConnectionStream) -> Self {
-        Self { stream }
+        Self {
+            stream: BufReader::new(stream),
+            line: Vec::new(),
+        }
     }
 
     pub async fn send(&mut self, msg: &Message) -> Result<()> {
@@ -179,13 +184,13 @@ impl IpcConnection {
             crate::telemetry::start_span("ipc.receive", opentelemetry::trace::SpanKind::Consumer);
 
         let result: Result<Option<Message>> = async {
-            let mut reader = BufReader::new(&mut self.stream);
-            let mut line = String::new();
-            if reader.read_line(&mut line).await? == 0 {
+            // read_until keeps partial input in `self.line` if cancelled by select!
+            if self.stream.read_until(b'\n', &mut self.line).await? == 0 {
                 return Ok(None);
             }
-            let msg = serde_json::from_str(&line)?;
-            Ok(Some(msg))
+            let parsed: serde_json::Result<Message> = serde_json::from_slice(&self.line);
+            self.line.clear();
+            Ok(Some(parsed?))
         }
         .await;
 
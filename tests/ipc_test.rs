@@ -66,3 +66,60 @@ async fn test_ipc_unix_socket_handshake() {
     server_handle.await.expect("Server task failed");
     let _ = tokio::fs::remove_file(socket_path).await;
 }
+
+#[tokio::test]
+async fn test_ipc_receive_multiple_lines_in_one_write() {
+    let socket_path = "test_ipc_batched.sock";
+    let _ = tokio::fs::remove_file(socket_path).await;
+
+    // Start Server
+    let server_handle = tokio::spawn(async move {
+        let server = IpcServer::new(socket_path, None)
+            .await
+            .expect("Failed to create server");
+        let mut conn = server.accept().await.expect("Failed to accept connection");
+
+        let first = conn
+            .receive()
+            .await
+            .expect("Failed to receive")
+            .expect("Stream Closed");
+        assert!(matches!(first, Message::Handshake { .. }));
+
+        // Second line arrived in the same read and must not be dropped
+        let second = conn
+            .receive()
+            .await
+            .expect("Failed to receive")
+            .expect("Stream Closed");
+        if let Message::PlayStart { name, host_pattern } = second {
+            assert_eq!(name, "Batched Play");
+            assert_eq!(host_pattern, "web,db");
+        } else {
+            panic!("Expected PlayStart, got {:?}", second);
+        }
+    });
+
+    // Give server time to bind
+    tokio::time::sleep(Duration::from_millis(100)).await;
+
+    let mut stream = UnixStream::connect(socket_path)
+        .await
+        .expect("Failed to connect to socket");
+
+    // Send Handshake and PlayStart in a single write, as the plugin batches them
+    let data = concat!(
+        r#"{"Handshake":{"token":null}}"#,
+        "\n",
+        r#"{"PlayStart":{"name":"Batched Play","host_pattern":"web,db"}}"#,
+        "\n"
+    );
+    stream
+        .write_all(data.as_bytes())
+        .await
+        .expect("Failed to write");
+
+    // Cleanup
+    server_handle.await.expect("Server task failed");
+    let _ = tokio::fs::remove_file(socket_path).await;
+}